@@ -3,13 +3,17 @@
 
 import pandas as pd
 import os
+import sys
 import folium
 import shutil
 import math
+import sqlite3
+from contextlib import closing
 from collections import defaultdict
 from pathlib import Path
 from IPython.display import IFrame, display
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from cleanup_files import cleanup_old_backups
 import parse_gpx_files
@@ -77,18 +81,20 @@ def offset_location(lat, lon):
     return new_lat, new_lon
 
 def process_gpx_file(args):
-    file_path, activity_df = args
+    file_path, trail_name, trail_day_name = args
     if os.path.getsize(file_path) == 0:
         print('Skipping this file due to it being EMPTY: ' + file_path)
         return None
 
-    df, points, activity = parse_gpx_files.process_gpx_to_df(file_path)
-    stats = parse_gpx_files.calculate_stats_from_df(df)
-    
-    trail_info = activity_df.loc[activity_df.Path == file_path].iloc[0]
-    trail_name = trail_info['Name']
-    trail_day_name = trail_info['OrderOfDays']
-    trail_day = int(float(trail_day_name.split('-')[0]))
+    # Errors are handled here because not all of them (e.g. gpxpy's GPXXMLSyntaxException) can be sent back to the main process
+    try:
+        df, points, activity = parse_gpx_files.process_gpx_to_df(file_path)
+        stats = parse_gpx_files.calculate_stats_from_df(df)
+        
+        trail_day = int(float(trail_day_name.split('-')[0]))
+    except Exception as e:
+        print(f'Skipping this file due to an error: {file_path}: {e}')
+        return None
     
     return {
         'file_path': file_path,
@@ -101,24 +107,44 @@ def process_gpx_file(args):
         'trail_day': trail_day
     }
 
-def create_map(gpx_file_path, gpx_files, activity_df, map_name, plot_method='poly_line', zoom_level=12, add_trail_info=False, mark_track_terminals=False, track_terminal_radius_size=2000, show_minimap=False, map_type='terrain', fullscreen=True, number_of_tracks="all", max_workers=20):
-    pd.set_option('display.precision', 0)
-    os.chdir(gpx_file_path)
-
-    trails_per_day = calculate_trails_per_day(activity_df)
-    print('Tracks per day: ' + str(trails_per_day))
-    
-    # Prepare arguments for parallel processing
-    args_list = [(file_path, activity_df) for file_path in gpx_files]
+def process_gpx_files(gpx_files, activity_df, max_workers=20):
+    # Prepare arguments for parallel processing, each task only gets the trail info of its own file
+    trail_info_df = activity_df.drop_duplicates(subset='Path').set_index('Path')
+    args_list = [(file_path, trail_info_df.at[file_path, 'Name'], trail_info_df.at[file_path, 'OrderOfDays']) for file_path in gpx_files]
     
     processed_files = []
 
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
         future_to_file = {executor.submit(process_gpx_file, args): args[0] for args in args_list}
         for future in as_completed(future_to_file):
-            processed_file = future.result()
+            # Errors while parsing are handled in process_gpx_file, only a broken pool aborts all files
+            try:
+                processed_file = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                print(f'Error processing file {future_to_file[future]}: {e}')
+                continue
             if processed_file is not None:
                 processed_files.append(processed_file)
+
+    return processed_files
+
+def create_map(gpx_file_path, gpx_files, activity_df, map_name, plot_method='poly_line', zoom_level=12, add_trail_info=False, mark_track_terminals=False, track_terminal_radius_size=2000, show_minimap=False, map_type='terrain', fullscreen=True, number_of_tracks="all", max_workers=20):
+    os.chdir(gpx_file_path)
+
+    processed_files = process_gpx_files(gpx_files, activity_df, max_workers)
+
+    render_map(processed_files, activity_df, map_name, plot_method=plot_method, zoom_level=zoom_level, add_trail_info=add_trail_info, mark_track_terminals=mark_track_terminals, track_terminal_radius_size=track_terminal_radius_size, show_minimap=show_minimap, map_type=map_type, fullscreen=fullscreen, number_of_tracks=number_of_tracks)
+
+def render_map(processed_files, activity_df, map_name, plot_method='poly_line', zoom_level=12, add_trail_info=False, mark_track_terminals=False, track_terminal_radius_size=2000, show_minimap=False, map_type='terrain', fullscreen=True, number_of_tracks="all"):
+    pd.set_option('display.precision', 0)
+
+    if not processed_files:
+        raise ValueError(f'No parsed tracks for map {map_name}')
+
+    trails_per_day = calculate_trails_per_day(activity_df)
+    print('Tracks per day: ' + str(trails_per_day))
     
     processed_files = sorted(processed_files, key=lambda x: x['trail_day'])
     
@@ -218,7 +244,7 @@ def create_map(gpx_file_path, gpx_files, activity_df, map_name, plot_method='pol
 
             elif file_path in order_of_days_df.mid_gpx.to_list() and add_trail_info==True:
                 #add 'mid' or 'end' marker, depending on how many tracks there are on camino (to approximate midpoint)
-                marker_location = order_of_days_df.loc[order_of_days_df.mid_gpx==file_path,'marker'][0]
+                marker_location = order_of_days_df.loc[order_of_days_df.mid_gpx==file_path,'marker'].iloc[0]
                 #mask = (camino_summary.index==Name)
                 #print('mask' + str(mask))
                 #camino_summary_for_icon = camino_summary[mask].melt().rename(columns={'variable':'Metric'}).set_index('Metric').round(1)
@@ -318,6 +344,84 @@ def create_map(gpx_file_path, gpx_files, activity_df, map_name, plot_method='pol
     print('Saving to map: ' + map_name)
     mymap.save(map_name)
 
+def render_map_task(args):
+    map_processed_files, activity_df, map_name, map_options = args
+    # Errors are handled here for the same reason as in process_gpx_file
+    try:
+        render_map(map_processed_files, activity_df, map_name, **map_options)
+    except Exception as e:
+        print(f'Skipping map due to an error: {map_name}: {e}')
+        return None
+    return map_name
+
+def filters_by_column(activity_df, column, base_path):
+    # One map per distinct value of a column (e.g. every 'Name' or every 'Family')
+    map_filters = {}
+    for value in activity_df[column].dropna().unique():
+        file_name = 'strava-' + str(value).lower().replace(' ', '-').replace('/', '-')
+        map_name = base_path + file_name + '.html'
+        # Values that only differ in case or in '/' vs. ' ' would end up in the same file
+        suffix = 2
+        while map_name in map_filters:
+            map_name = base_path + file_name + '-' + str(suffix) + '.html'
+            suffix += 1
+        if suffix > 2:
+            print(f"Map file name for '{value}' is already taken, saving to {map_name} instead")
+        map_filters[map_name] = activity_df[column] == value
+    return map_filters
+
+def create_maps(gpx_file_path, activity_df, map_filters, max_workers=20, **map_options):
+    # map_filters maps the output file name to either a boolean mask on activity_df or a query string (see DataFrame.query)
+    # All GPX files are parsed once for the union of the filters and the maps are rendered in parallel afterwards
+    if not map_filters:
+        print('No map filters given, no maps will be created')
+        return []
+
+    os.chdir(gpx_file_path)
+
+    selected_dfs = {}
+    for map_name, map_filter in map_filters.items():
+        if isinstance(map_filter, str):
+            selected_dfs[map_name] = activity_df.query(map_filter)
+        else:
+            selected_dfs[map_name] = activity_df[map_filter]
+
+    union_df = pd.concat(selected_dfs.values()).drop_duplicates(subset='Path')
+    print(f'Parsing {len(union_df)} tracks for {len(selected_dfs)} maps')
+
+    processed_files = process_gpx_files(union_df.Path.to_list(), union_df, max_workers)
+    processed_files_by_path = {processed_file['file_path']: processed_file for processed_file in processed_files}
+
+    # Each map only gets the parsed tracks it displays
+    render_tasks = {}
+    for map_name, selected_df in selected_dfs.items():
+        map_processed_files = [processed_files_by_path[path] for path in selected_df.Path if path in processed_files_by_path]
+        if not map_processed_files:
+            print('Skipping map due to it having no parsed tracks: ' + map_name)
+            continue
+        render_tasks[map_name] = (map_processed_files, selected_df)
+
+    saved_maps = []
+
+    if not render_tasks:
+        return saved_maps
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(render_tasks))) as executor:
+        future_to_map = {executor.submit(render_map_task, (map_processed_files, selected_df, map_name, map_options)): map_name for map_name, (map_processed_files, selected_df) in render_tasks.items()}
+        for future in as_completed(future_to_map):
+            # Errors while rendering are handled in render_map_task, only a broken pool aborts all maps
+            try:
+                saved_map = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                print(f'Error creating map {future_to_map[future]}: {e}')
+                continue
+            if saved_map is not None:
+                saved_maps.append(saved_map)
+
+    return sorted(saved_maps)
+
 def set_pandas_options():
     pd.set_option('display.max_columns', None)
     pd.set_option('display.width', None)
@@ -419,6 +523,115 @@ def  create_dataframe(strava_base_path, strava_merged_comment_file, strava_expor
     shutil.copyfile(strava_base_path + strava_merged_comment_file + '.csv', strava_base_path + 'sicherungskopien/' + strava_merged_comment_file + '-' + datetime.now().strftime("%Y-%m-%d-%H-%M") +'.csv')
 
 
+def find_gpx_file(gpx_directory, activity_id):
+    # GPX files are stored by strava-offline as <activity id>.gpx or <activity id>.gpx.gz, the unzipped file is preferred like in strava-offline
+    for filename in [str(activity_id) + '.gpx', str(activity_id) + '.gpx.gz']:
+        if os.path.exists(os.path.join(gpx_directory, filename)):
+            return filename
+    return None
+
+def default_strava_offline_database_path():
+    # 'strava-offline sqlite' writes to its per-user data directory unless --database is given
+    if sys.platform == 'darwin':
+        data_directory = os.path.expanduser('~/Library/Application Support')
+    elif sys.platform == 'win32':
+        data_directory = os.environ.get('LOCALAPPDATA', os.path.expanduser('~/AppData/Local'))
+    else:
+        data_directory = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(data_directory, 'strava_offline', 'strava.sqlite')
+
+def read_strava_offline_database(strava_database_path, gpx_directory, strava_types=None):
+    # This is the database that comes from the Strava export tool, one row per activity
+    # https://github.com/liskin/strava-offline
+    # strava_types filters by Strava's own type names (e.g. 'Hike', 'Run'), which are returned in column 'stravaType'
+    query = 'SELECT id, start_date, type, distance, elapsed_time, total_elevation_gain FROM activity'
+    params = []
+    if strava_types is not None:
+        query += ' WHERE type IN (' + ','.join('?' * len(strava_types)) + ')'
+        params = list(strava_types)
+    query += ' ORDER BY start_date'
+
+    # Open read-only so the strava-offline database is never modified
+    with closing(sqlite3.connect(Path(strava_database_path).resolve().as_uri() + '?mode=ro', uri=True)) as connection:
+        activities_df = pd.read_sql_query(query, connection, params=params)
+
+    print(f'Successfully read {len(activities_df)} activities from {strava_database_path}')
+
+    # Activities without a GPX file (e.g. manually added ones) are dropped
+    activities_df['Path'] = activities_df['id'].map(lambda activity_id: find_gpx_file(gpx_directory, activity_id))
+    activities_df = activities_df[activities_df['Path'].notnull()]
+
+    # Use the same activity types as the GPX files (e.g. 'Hike' -> 'hiking')
+    # Types without a known GPX name are only lowercased, the original Strava type is kept in 'stravaType'
+    strava_activity_types = {
+        'Hike': 'hiking', 'Walk': 'walking', 'Snowshoe': 'snowshoeing',
+        'Run': 'running', 'TrailRun': 'running', 'VirtualRun': 'running',
+        'Ride': 'cycling', 'MountainBikeRide': 'cycling', 'GravelRide': 'cycling', 'EBikeRide': 'cycling', 'EMountainBikeRide': 'cycling', 'VirtualRide': 'cycling',
+        'Swim': 'swimming', 'AlpineSki': 'alpine_skiing', 'BackcountrySki': 'backcountry_skiing', 'NordicSki': 'nordic_skiing'
+    }
+
+    return pd.DataFrame({
+        'Time': activities_df['start_date'],
+        'activityType': activities_df['type'].map(lambda x: strava_activity_types.get(x, str(x).lower())).astype('string'),
+        'stravaType': activities_df['type'].astype('string'),
+        'Path': activities_df['Path'].astype('string'),
+        'distance_km': activities_df['distance'] / 1000,
+        'elapsed_time_sec': activities_df['elapsed_time'],
+        'elevationGain': activities_df['total_elevation_gain']
+    })
+
+def create_dataframe_from_database(strava_base_path, strava_database_path, strava_merged_comment_file, strava_export_file_with_comments_dtypes):
+    # Same as create_dataframe, but reads the activities from the strava-offline database instead of the strava2csv export file
+    backup_directory = strava_base_path + '/sicherungskopien'
+
+    # Delete old backups
+    cleanup_old_backups(backup_directory)
+
+    os.chdir(strava_base_path)
+
+    strava_export_df = read_strava_offline_database(strava_database_path, strava_base_path + 'output/')
+
+    # Store file names without '.gz', as they are after the GPX files were extracted
+    strava_export_df['Path'] = strava_export_df['Path'].apply(parse_gpx_files.remove_gz)
+
+    strava_merged_comment_file_path = strava_base_path + strava_merged_comment_file + '.csv'
+
+    try:
+        if not os.path.exists(strava_merged_comment_file_path):
+            raise FileNotFoundError(f"File not found: {strava_merged_comment_file_path}")
+        strava_merged_comment_file_df = read_csv_with_separators(strava_merged_comment_file_path,
+                                                        strava_export_file_with_comments_dtypes, ['Time', 'activityType', 'Path', 'Name', 'OrderOfDays', 'Family'])
+        print(f'Successfully read file {strava_merged_comment_file}')
+
+        print("Comment file will be merged with database activities.")
+
+        # Create a backup
+        shutil.copyfile(strava_merged_comment_file_path, strava_base_path + 'sicherungskopien/' + strava_merged_comment_file + '-' + datetime.now().strftime("%Y-%m-%d-%H-%M") +'.csv')
+
+        # Merge on Path only: the database holds the activity start time, the CSV export the time of the first GPS point
+        # The comment file may still contain zipped file names (e.g. 1234.gpx.gz) from the strava2csv export file
+        # New activities are kept with empty comments, so they can be commented
+        strava_merged_comment_file_df['Path'] = strava_merged_comment_file_df['Path'].apply(parse_gpx_files.remove_gz)
+        strava_merged_file_df = pd.merge(strava_export_df, strava_merged_comment_file_df.drop(columns=['Time', 'activityType']), on=["Path"], how = "left")
+
+        # Never overwrite the comment file if manually added comments would get lost
+        commented_paths = strava_merged_comment_file_df.loc[strava_merged_comment_file_df[['Name', 'OrderOfDays', 'Family']].notnull().any(axis=1), 'Path']
+        lost_paths = commented_paths[~commented_paths.isin(strava_merged_file_df['Path'])].to_list()
+        if lost_paths:
+            raise ValueError(f"{len(lost_paths)} commented activities are not in the database, comment file will not be overwritten: {lost_paths[:10]}")
+
+    except FileNotFoundError as e:
+        print("The comment file is still empty. Only header names will be added.")
+
+        headers = pd.DataFrame(columns=['Name', 'OrderOfDays', 'Family'])
+        strava_merged_file_df = pd.concat([strava_export_df, headers], axis=1)
+
+    strava_merged_file_df.to_csv(strava_merged_comment_file_path, index=False)
+
+    # Create a backup of merged file
+    shutil.copyfile(strava_merged_comment_file_path, strava_base_path + 'sicherungskopien/' + strava_merged_comment_file + '-' + datetime.now().strftime("%Y-%m-%d-%H-%M") +'.csv')
+
+
 def main():
     set_pandas_options()
 
@@ -428,7 +641,16 @@ def main():
 
     strava_export_file_with_comments_dtypes = {'Path': 'string', 'activityType': 'string', 'Name': 'string', 'OrderOfDays': 'string', 'Family': 'string'}
 
-    create_dataframe(strava_base_path, strava_merged_comment_file_name, strava_export_file_with_comments_dtypes)
+    # This is the database that 'strava-offline sqlite' writes to, it is preferred over the strava2csv export file
+    # Set the path here if strava-offline is run with --database
+    strava_database_path = default_strava_offline_database_path()
+
+    if os.path.exists(strava_database_path):
+        print(f'Reading activities from strava-offline database {strava_database_path}')
+        create_dataframe_from_database(strava_base_path, strava_database_path, strava_merged_comment_file_name, strava_export_file_with_comments_dtypes)
+    else:
+        print(f'No strava-offline database found in {strava_database_path}, reading activities from strava2csv export file')
+        create_dataframe(strava_base_path, strava_merged_comment_file_name, strava_export_file_with_comments_dtypes)
 
     
     # 4. Manually put in comments
@@ -496,6 +718,9 @@ def main():
 
     create_map(gpx_file_path, tracks_to_display, tracks_to_display_df, map_name, plot_method='poly_line', zoom_level=6, add_trail_info=True, mark_track_terminals=True, track_terminal_radius_size=100, map_type='regular', number_of_tracks=numberOfTracks)
 
+    # Alternatively, render one map per trail (or per family) from a single parse of all tracks
+    #create_maps(gpx_file_path, strava_hiking_file_df, filters_by_column(strava_hiking_file_df, 'Name', base_path), plot_method='poly_line', zoom_level=6, add_trail_info=True, mark_track_terminals=True, track_terminal_radius_size=100, map_type='regular', number_of_tracks=numberOfTracks)
+
     print(map_name)
 
     # Set working directory to base_path
@@ -0,0 +1,13 @@
+import importlib.util
+import os
+import sys
+
+SRC_PATH = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, SRC_PATH)
+
+# The script name contains a dash, hence it has to be loaded by path
+# It is registered as a module so that its functions can be sent to worker processes
+spec = importlib.util.spec_from_file_location('strava_tryout', os.path.join(SRC_PATH, 'strava-tryout.py'))
+strava_tryout = importlib.util.module_from_spec(spec)
+sys.modules['strava_tryout'] = strava_tryout
+spec.loader.exec_module(strava_tryout)
@@ -0,0 +1,98 @@
+import os
+
+import pandas as pd
+import pytest
+
+import strava_tryout
+
+GPX_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+<trk><type>hiking</type><trkseg>
+<trkpt lat="{lat:.2f}" lon="11.00"><ele>1000</ele><time>2021-09-0{day}T08:00:00Z</time></trkpt>
+<trkpt lat="{lat:.2f}" lon="11.05"><ele>1100</ele><time>2021-09-0{day}T09:00:00Z</time></trkpt>
+<trkpt lat="{lat:.2f}" lon="11.10"><ele>1050</ele><time>2021-09-0{day}T10:00:00Z</time></trkpt>
+</trkseg></trk>
+</gpx>
+'''
+
+
+@pytest.fixture
+def gpx_file_path(tmp_path, monkeypatch):
+    # create_maps changes the working directory, it is restored after each test
+    monkeypatch.chdir(tmp_path)
+    for day in range(1, 5):
+        (tmp_path / f'{day}.gpx').write_text(GPX_TEMPLATE.format(lat=47 + day / 10, day=day))
+    (tmp_path / 'empty.gpx').write_text('')
+    (tmp_path / 'garbage.gpx').write_text('garbage')
+    return str(tmp_path) + '/'
+
+
+@pytest.fixture
+def activity_df():
+    return pd.DataFrame({
+        'Date': ['2021-09-01', '2021-09-02', '2021-09-03', '2021-09-04', '2021-09-05', '2021-09-06'],
+        'Path': ['1.gpx', '2.gpx', '3.gpx', '4.gpx', 'empty.gpx', 'garbage.gpx'],
+        'Name': ['Tauern Hoehenweg', 'Tauern Hoehenweg', 'Stubaier Hoehenweg', 'Stubaier Hoehenweg', 'Empty Trail', 'Broken Trail'],
+        'OrderOfDays': ['1', '2', '1', '2', '1', '1'],
+        'Family': ['Mehrtagestouren', 'Mehrtagestouren', 'Mehrtagestouren', 'Mehrtagestouren', 'Tagestouren', 'Tagestouren'],
+    })
+
+
+def test_filters_by_column():
+    df = pd.DataFrame({'Name': ['A B', 'A/B', 'a b', 'C', None]})
+
+    map_filters = strava_tryout.filters_by_column(df, 'Name', '/maps/')
+
+    assert list(map_filters) == ['/maps/strava-a-b.html', '/maps/strava-a-b-2.html', '/maps/strava-a-b-3.html', '/maps/strava-c.html']
+    assert map_filters['/maps/strava-a-b-2.html'].to_list() == [False, True, False, False, False]
+
+
+def test_create_maps_parses_shared_tracks_once(gpx_file_path, activity_df, monkeypatch):
+    parsed_files = []
+    process_gpx_files = strava_tryout.process_gpx_files
+
+    def record_process_gpx_files(gpx_files, activity_df, max_workers=20):
+        parsed_files.extend(gpx_files)
+        return process_gpx_files(gpx_files, activity_df, max_workers)
+
+    monkeypatch.setattr(strava_tryout, 'process_gpx_files', record_process_gpx_files)
+
+    map_filters = {
+        gpx_file_path + 'tauern.html': activity_df.Name == 'Tauern Hoehenweg',
+        gpx_file_path + 'stubaier.html': "Name == 'Stubaier Hoehenweg'",
+        gpx_file_path + 'family.html': "Family == 'Mehrtagestouren'",
+    }
+
+    saved_maps = strava_tryout.create_maps(gpx_file_path, activity_df, map_filters, max_workers=2, add_trail_info=True)
+
+    assert sorted(parsed_files) == ['1.gpx', '2.gpx', '3.gpx', '4.gpx']
+    assert saved_maps == sorted(map_filters)
+    for map_name in saved_maps:
+        assert os.path.getsize(map_name) > 0
+
+
+def test_create_maps_skips_maps_without_parsed_tracks(gpx_file_path, activity_df):
+    map_filters = strava_tryout.filters_by_column(activity_df, 'Name', gpx_file_path)
+
+    saved_maps = strava_tryout.create_maps(gpx_file_path, activity_df, map_filters, max_workers=2, add_trail_info=True)
+
+    assert saved_maps == [gpx_file_path + 'strava-stubaier-hoehenweg.html', gpx_file_path + 'strava-tauern-hoehenweg.html']
+    assert not os.path.exists(gpx_file_path + 'strava-empty-trail.html')
+    assert not os.path.exists(gpx_file_path + 'strava-broken-trail.html')
+
+
+def test_create_maps_without_filters(gpx_file_path, activity_df):
+    assert strava_tryout.create_maps(gpx_file_path, activity_df, {}) == []
+
+
+def test_process_gpx_files_skips_broken_files(gpx_file_path, activity_df):
+    processed_files = strava_tryout.process_gpx_files(activity_df.Path.to_list(), activity_df, max_workers=2)
+
+    assert sorted(processed_file['file_path'] for processed_file in processed_files) == ['1.gpx', '2.gpx', '3.gpx', '4.gpx']
+
+
+def test_create_map_without_parsed_tracks(gpx_file_path, activity_df):
+    broken_df = activity_df[activity_df.Name == 'Broken Trail']
+
+    with pytest.raises(ValueError, match='No parsed tracks for map'):
+        strava_tryout.create_map(gpx_file_path, broken_df.Path.to_list(), broken_df, gpx_file_path + 'broken.html', max_workers=1)
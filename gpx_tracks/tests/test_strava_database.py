@@ -0,0 +1,104 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import strava_tryout
+
+COMMENT_FILE = 'strava-comments'
+COMMENT_FILE_DTYPES = {'Path': 'string', 'activityType': 'string', 'Name': 'string', 'OrderOfDays': 'string', 'Family': 'string'}
+
+
+@pytest.fixture
+def strava_base_path(tmp_path):
+    # Same subset of the strava-offline activity table that is queried
+    connection = sqlite3.connect(tmp_path / 'strava.sqlite')
+    connection.execute('CREATE TABLE activity (id INTEGER PRIMARY KEY, name TEXT, start_date TEXT, type TEXT, distance REAL, elapsed_time INTEGER, total_elevation_gain REAL)')
+    connection.executemany('INSERT INTO activity VALUES (?, ?, ?, ?, ?, ?, ?)', [
+        (1, 'Day 1', '2021-09-01T08:00:00Z', 'Hike', 12500.0, 18000, 800.0),
+        (2, 'Day 2', '2021-09-02T08:00:00Z', 'Hike', 9000.0, 14400, 650.0),
+        (3, 'Evening run', '2021-09-03T18:00:00Z', 'Run', 5000.0, 1800, 20.0),
+        (4, 'Manual entry', '2021-09-04T10:00:00Z', 'Walk', 3000.0, 3600, 0.0),
+        (5, 'New trail run', '2021-09-05T07:00:00Z', 'TrailRun', 15000.0, 7200, 900.0),
+    ])
+    connection.commit()
+    connection.close()
+
+    # Activity 4 has no GPX file, activity 2 exists both unzipped and zipped
+    output_path = tmp_path / 'output'
+    output_path.mkdir()
+    for filename in ['1.gpx', '2.gpx', '2.gpx.gz', '3.gpx.gz', '5.gpx.gz']:
+        (output_path / filename).write_text('')
+
+    (tmp_path / 'sicherungskopien').mkdir()
+
+    # Comment rows were created from strava2csv and still contain the zipped file names, activity 5 is new
+    pd.DataFrame({
+        'Time': ['2021-09-01T08:00:01.973Z', '2021-09-02T08:00:02Z', '2021-09-03T18:00:00Z'],
+        'activityType': ['hiking', 'hiking', 'running'],
+        'Path': ['1.gpx.gz', '2.gpx.gz', '3.gpx.gz'],
+        'Name': ['Tauern Hoehenweg', 'Tauern Hoehenweg', None],
+        'OrderOfDays': ['1', '2', None],
+        'Family': ['Mehrtagestouren', 'Mehrtagestouren', None],
+    }).to_csv(tmp_path / (COMMENT_FILE + '.csv'), index=False)
+
+    return str(tmp_path) + '/'
+
+
+def test_read_strava_offline_database(strava_base_path):
+    df = strava_tryout.read_strava_offline_database(strava_base_path + 'strava.sqlite', strava_base_path + 'output/')
+
+    assert df['Path'].to_list() == ['1.gpx', '2.gpx', '3.gpx.gz', '5.gpx.gz']
+    assert df['activityType'].to_list() == ['hiking', 'hiking', 'running', 'running']
+    assert df['stravaType'].to_list() == ['Hike', 'Hike', 'Run', 'TrailRun']
+    assert df['Time'].to_list() == ['2021-09-01T08:00:00Z', '2021-09-02T08:00:00Z', '2021-09-03T18:00:00Z', '2021-09-05T07:00:00Z']
+    assert df['distance_km'].to_list() == [12.5, 9.0, 5.0, 15.0]
+    assert df['elapsed_time_sec'].to_list() == [18000, 14400, 1800, 7200]
+    assert df['elevationGain'].to_list() == [800.0, 650.0, 20.0, 900.0]
+
+
+def test_read_strava_offline_database_by_strava_type(strava_base_path):
+    df = strava_tryout.read_strava_offline_database(strava_base_path + 'strava.sqlite', strava_base_path + 'output/', strava_types=['Run', 'Walk'])
+
+    assert df['Path'].to_list() == ['3.gpx.gz']
+    assert df['activityType'].to_list() == ['running']
+    assert df['stravaType'].to_list() == ['Run']
+
+
+def test_create_dataframe_from_database_without_comment_file(strava_base_path, monkeypatch):
+    monkeypatch.chdir(strava_base_path)
+    comment_file_path = strava_base_path + 'new-comments.csv'
+
+    strava_tryout.create_dataframe_from_database(strava_base_path, strava_base_path + 'strava.sqlite', 'new-comments', COMMENT_FILE_DTYPES)
+
+    df = pd.read_csv(comment_file_path, dtype=COMMENT_FILE_DTYPES)
+    assert df['Path'].to_list() == ['1.gpx', '2.gpx', '3.gpx', '5.gpx']
+    assert df['Name'].isnull().all()
+
+
+def test_create_dataframe_from_database_keeps_comments(strava_base_path, monkeypatch):
+    monkeypatch.chdir(strava_base_path)
+
+    strava_tryout.create_dataframe_from_database(strava_base_path, strava_base_path + 'strava.sqlite', COMMENT_FILE, COMMENT_FILE_DTYPES)
+
+    df = pd.read_csv(strava_base_path + COMMENT_FILE + '.csv', dtype=COMMENT_FILE_DTYPES)
+    assert df['Path'].to_list() == ['1.gpx', '2.gpx', '3.gpx', '5.gpx']
+    assert df['Name'].to_list()[:2] == ['Tauern Hoehenweg', 'Tauern Hoehenweg']
+    assert df['OrderOfDays'].to_list()[:2] == ['1', '2']
+    assert df['Family'].to_list()[:2] == ['Mehrtagestouren', 'Mehrtagestouren']
+    # The new activity is added with empty comments
+    assert df[['Name', 'OrderOfDays', 'Family']].iloc[3].isnull().all()
+
+
+def test_create_dataframe_from_database_refuses_to_drop_comments(strava_base_path, monkeypatch):
+    monkeypatch.chdir(strava_base_path)
+    comment_file_path = strava_base_path + COMMENT_FILE + '.csv'
+    pd.read_csv(comment_file_path).replace({'Path': {'2.gpx.gz': '99.gpx.gz'}}).to_csv(comment_file_path, index=False)
+    with open(comment_file_path) as comment_file:
+        comment_file_content = comment_file.read()
+
+    with pytest.raises(ValueError, match='99.gpx'):
+        strava_tryout.create_dataframe_from_database(strava_base_path, strava_base_path + 'strava.sqlite', COMMENT_FILE, COMMENT_FILE_DTYPES)
+
+    with open(comment_file_path) as comment_file:
+        assert comment_file.read() == comment_file_content